@@ -1,21 +1,50 @@
 # app.py - full updated (orders with payment, optional Twilio WhatsApp, tracking fixes)
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, date
+import json
+import copy
 import csv
+import re
+from itertools import groupby
+from collections import OrderedDict
+from types import SimpleNamespace
 import io
 import urllib.parse
+import urllib.request
+import urllib.error
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import secrets
+import shutil
 import smtplib
+import sqlite3
+import threading
+import time
+import math
+import random
 from email.message import EmailMessage
 from functools import wraps
 
 from itsdangerous import URLSafeTimedSerializer
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from flask import (
     Flask, render_template, request, redirect, url_for, flash,
-    session, Response, abort
+    session, Response, abort, stream_with_context, jsonify, stream_template
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm.attributes import set_committed_value
+import click
+
+# Optional argon2 (PASSWORD_HASH_METHOD = "argon2") - pip install argon2-cffi to enable.
+try:
+    from argon2 import PasswordHasher as Argon2Hasher
+    from argon2.exceptions import VerificationError as Argon2VerificationError, InvalidHashError as Argon2InvalidHash
+except Exception:
+    Argon2Hasher = None
 
 # Optional Twilio (for automatic WhatsApp) - install twilio if you will enable this.
 try:
@@ -47,19 +76,88 @@ app.config["EMAIL_USER"] = ""        # your SMTP user (email)
 app.config["EMAIL_PASSWORD"] = ""    # SMTP password/app password
 app.config["OWNER_EMAIL"] = ""       # admin notification email
 
+# Password hashing. Any Werkzeug method string ("pbkdf2:sha256:<iterations>",
+# "scrypt:<n>:<r>:<p>") or "argon2". Run `flask --app app bench-hash --target-ms 250`
+# to pick a cost for this server; older hashes are upgraded on the next successful login.
+app.config["PASSWORD_HASH_METHOD"] = "scrypt:32768:8:1"
+app.config["ARGON2_TIME_COST"] = 2
+app.config["ARGON2_MEMORY_COST"] = 19456  # KiB
+app.config["ARGON2_PARALLELISM"] = 1
+# at most this many hashes run at once across all workers on the host (keep it below the
+# gunicorn worker count so order pages always have a free worker); waiters past the timeout get a 503
+app.config["PASSWORD_HASH_SLOTS"] = 2
+app.config["PASSWORD_HASH_TIMEOUT"] = 2  # seconds to wait for a slot
+
 # Twilio config (optional) - for automated WhatsApp messages
 # To enable, install twilio: pip install twilio and fill these
 app.config["TWILIO_ACCOUNT_SID"] = ""
 app.config["TWILIO_AUTH_TOKEN"] = ""
 app.config["TWILIO_WHATSAPP_FROM"] = "whatsapp:+14155238886"  # Twilio sandbox default (replace)
+# REST base used by broadcasts; point at fake_twilio.py (http://127.0.0.1:8765) for local testing
+app.config["TWILIO_API_BASE"] = "https://api.twilio.com"
+
+# Bulk WhatsApp broadcasts (flask --app app broadcast "...")
+app.config["BROADCAST_RATE_PER_SECOND"] = 5   # stay under the Twilio sender's throughput
+app.config["BROADCAST_CONCURRENCY"] = 4       # in-flight HTTP requests
+app.config["BROADCAST_CHUNK_SIZE"] = 200      # orders scanned (and checkpointed) per step
 
-# Payment instructions (editable in code or via admin UI in future)
+# Payment instructions - defaults only; the live values come from instance/settings.json
+# (edited at /admin/settings) through get_payment_instructions()
 app.config["PAYMENT_INSTRUCTIONS"] = {
     "bank_account": "Bank: ABC Bank\nA/C: 1234567890\nIFSC: ABCD0123456\nName: MMVALI Farm",
     "upi": "mmvali@upi",
     "note": "After payment, WhatsApp / email admin with your Order ID to confirm."
 }
 
+# Reverse proxies (e.g. nginx) in front of gunicorn that we trust to set X-Forwarded-For/-Proto.
+# Off by default: without a proxy, clients could spoof their IP and dodge rate limits. Behind
+# one, set MMVALI_PROXY_HOPS=1 or every client shares the proxy's IP and rate-limit bucket.
+app.config["PROXY_HOPS"] = int(os.environ.get("MMVALI_PROXY_HOPS", "0"))
+if app.config["PROXY_HOPS"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_HOPS"], x_proto=app.config["PROXY_HOPS"])
+
+# Rate limiting - token buckets per client IP and per account.
+# "sqlite" shares buckets across gunicorn workers via a small side file; "memory" is per-process.
+app.config["RATELIMIT_ENABLED"] = True
+app.config["RATELIMIT_BACKEND"] = "sqlite"
+app.config["RATELIMIT_DB"] = os.path.join(INSTANCE_DIR, "ratelimit.db")
+# policy name -> (burst capacity, tokens refilled per second)
+app.config["RATELIMIT_POLICIES"] = {
+    "login": (5, 5 / 60),            # 5 attempts, then 1 every 12s
+    "register": (3, 3 / 600),        # 3 accounts per 10 min
+    "track": (10, 10 / 60),          # 10 lookups, then 1 every 6s
+    "reset_request": (3, 3 / 3600),  # 3 reset emails per hour
+}
+
+# Admin live order feed: the page polls /admin/orders/changes?after=<id>. Short requests
+# rather than a held-open stream, so each admin tab doesn't pin a sync gunicorn worker.
+app.config["ORDER_FEED_POLL_SECONDS"] = 3
+app.config["ORDER_FEED_BATCH"] = 100
+app.config["ORDER_EVENT_RETENTION_DAYS"] = 7
+
+# Daily production capacity (units per day). Products not listed are unlimited.
+app.config["DAILY_CAPACITY"] = {
+    "Fresh Cow Milk (1L)": 120,
+    "Milk Kova (200g)": 30,
+    "Paneer (200g)": 40,
+}
+
+# Background jobs. Only the web server starts them (gunicorn.conf.py post_worker_init, or
+# python app.py), never the flask CLI; one process per host runs them, see start_scheduler.
+app.config["SCHEDULER_ENABLED"] = os.environ.get("MMVALI_SCHEDULER", "1") == "1"
+app.config["PENDING_PAYMENT_TIMEOUT_MINUTES"] = 60  # ONLINE orders unpaid this long are expired
+app.config["SWEEP_INTERVAL_SECONDS"] = 300
+app.config["SWEEP_BATCH_SIZE"] = 200
+app.config["BACKUP_INTERVAL_SECONDS"] = 0  # >0 to run backup_db.py snapshots from the scheduler
+
+# Order status snapshots for /track, /order/success and the polling endpoint
+app.config["STATUS_CACHE_DB"] = os.path.join(INSTANCE_DIR, "cache.db")
+app.config["TRACKING_TOKEN_MAX_AGE"] = 60 * 60 * 24 * 30  # 30 days
+app.config["STATUS_CACHE_TTL"] = 60  # upper bound on staleness if a refill races an invalidation
+
+# Runtime settings (instance/settings.json, edited at /admin/settings) are re-checked this often per worker
+app.config["SETTINGS_CHECK_SECONDS"] = 1.0
+
 # Token serializer
 serializer = URLSafeTimedSerializer(app.secret_key)
 
@@ -73,6 +171,162 @@ def get_twilio_client():
         return TwilioClient(sid, token)
     return None
 
+# -------------------------
+# PASSWORD HASHING
+# -------------------------
+class PasswordHashingBusy(Exception):
+    """All hashing slots are taken; the request is turned away with 503."""
+
+
+def get_argon2_hasher():
+    return Argon2Hasher(
+        time_cost=app.config["ARGON2_TIME_COST"],
+        memory_cost=app.config["ARGON2_MEMORY_COST"],
+        parallelism=app.config["ARGON2_PARALLELISM"],
+    )
+
+def hash_password(password, method=None):
+    method = method or app.config["PASSWORD_HASH_METHOD"]
+    if method == "argon2":
+        if Argon2Hasher is not None:
+            return get_argon2_hasher().hash(password)
+        print("hash_password: argon2-cffi not installed; using Werkzeug default.")
+        return generate_password_hash(password)
+    return generate_password_hash(password, method=method)
+
+def verify_password(stored, password):
+    if not stored:
+        return False
+    if stored.startswith("$argon2"):
+        if Argon2Hasher is None:
+            print("verify_password: argon2 hash stored but argon2-cffi is not installed")
+            return False
+        try:
+            return get_argon2_hasher().verify(stored, password)
+        except (Argon2VerificationError, Argon2InvalidHash):
+            return False
+    return check_password_hash(stored, password)
+
+_method_prefixes = {}
+
+def werkzeug_method_prefix(method):
+    """The "method:params" prefix Werkzeug actually writes for `method`.
+
+    Werkzeug fills in its defaults ("scrypt" -> "scrypt:32768:8:1"), so hash a probe
+    once per method rather than comparing against the configured string as written.
+    """
+    if method not in _method_prefixes:
+        _method_prefixes[method] = generate_password_hash("probe", method=method).split("$", 1)[0]
+    return _method_prefixes[method]
+
+def password_needs_rehash(stored):
+    """True when a stored hash uses a different method or cost than configured."""
+    method = app.config["PASSWORD_HASH_METHOD"]
+    if method == "argon2":
+        if Argon2Hasher is None:
+            return False  # can't produce argon2 hashes here; keep what we have
+        return not stored.startswith("$argon2") or get_argon2_hasher().check_needs_rehash(stored)
+    return stored.split("$", 1)[0] != werkzeug_method_prefix(method)
+
+class HostSlots:
+    """A host-wide counting semaphore built from `count` flock'd slot files.
+
+    Gunicorn's sync workers are separate processes serving one request each, so an
+    in-process pool can't cap hashing; a lock file per slot caps it across all of them.
+    """
+
+    def __init__(self, directory, name, count):
+        self.paths = [os.path.join(directory, f"{name}-{i}.lock") for i in range(max(count, 1))]
+        self._fallback = threading.BoundedSemaphore(len(self.paths))
+
+    def acquire(self, timeout):
+        """Returns an open slot file to hand back to release(), or None on timeout."""
+        try:
+            import fcntl
+        except ImportError:  # no flock (Windows dev box): single process, per-process limit is enough
+            return self._fallback if self._fallback.acquire(timeout=timeout) else None
+        deadline = time.monotonic() + timeout
+        while True:
+            for path in random.sample(self.paths, len(self.paths)):
+                f = open(path, "a")
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return f
+                except OSError:
+                    f.close()
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.02)
+
+    def release(self, slot):
+        if slot is self._fallback:
+            slot.release()
+        else:
+            slot.close()  # closing the file drops the flock
+
+
+_hash_slots = HostSlots(INSTANCE_DIR, "pwhash", app.config["PASSWORD_HASH_SLOTS"])
+
+def run_password_job(fn, *args):
+    """Run a hash/verify once a host-wide slot is free, so login bursts can't take every CPU."""
+    slot = _hash_slots.acquire(app.config["PASSWORD_HASH_TIMEOUT"])
+    if slot is None:
+        raise PasswordHashingBusy()
+    try:
+        return fn(*args)
+    finally:
+        _hash_slots.release(slot)
+
+@app.errorhandler(PasswordHashingBusy)
+def password_hashing_busy(e):
+    return Response("Server busy, please try again in a few seconds.\n", status=503,
+                    mimetype="text/plain", headers={"Retry-After": "5"})
+
+@app.cli.command("bench-hash")
+@click.option("--method", help="hash method to measure (default PASSWORD_HASH_METHOD)")
+@click.option("--seconds", default=3.0, help="measuring time per phase")
+@click.option("--target-ms", type=float, help="also suggest a pbkdf2/scrypt cost for this many ms per hash")
+def bench_hash_command(method, seconds, target_ms):
+    """Report password hashes per second per core (and across all cores)."""
+    method = method or app.config["PASSWORD_HASH_METHOD"]
+    cores = os.cpu_count() or 1
+
+    def spin(deadline, counts, idx):
+        n, start = 0, time.monotonic()
+        while time.monotonic() < deadline:
+            hash_password("benchmark-password", method)
+            n += 1
+        counts[idx] = n / (time.monotonic() - start)
+
+    counts = [0]
+    spin(time.monotonic() + seconds, counts, 0)
+    per_core = counts[0]
+    print(f"{method}: {per_core:.1f} hashes/s on one core ({1000 / per_core:.1f} ms each)")
+
+    counts = [0] * cores
+    deadline = time.monotonic() + seconds
+    threads = [threading.Thread(target=spin, args=(deadline, counts, i)) for i in range(cores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = sum(counts)
+    print(f"{method}: {total:.1f} hashes/s on {cores} threads ({total / cores:.1f} per core)")
+
+    if target_ms and method.startswith(("pbkdf2", "scrypt")):
+        scale = target_ms / (1000 / per_core)
+        parts = method.split(":")
+        if parts[0] == "pbkdf2":
+            iterations = int(parts[2]) if len(parts) > 2 else 600000
+            print(f"suggested for ~{target_ms:.0f} ms: pbkdf2:{parts[1] if len(parts) > 1 else 'sha256'}:"
+                  f"{max(100000, int(iterations * scale))}")
+        else:
+            n = int(parts[1]) if len(parts) > 1 else 32768
+            # scrypt N must be a power of two
+            n = 2 ** max(14, round(math.log2(max(1, n * scale))))
+            print(f"suggested for ~{target_ms:.0f} ms: scrypt:{n}:{parts[2] if len(parts) > 2 else 8}:"
+                  f"{parts[3] if len(parts) > 3 else 1}")
+
 # -------------------------
 # MODELS
 # -------------------------
@@ -86,10 +340,17 @@ class User(db.Model):
     orders = db.relationship("Order", backref="user", lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = run_password_job(hash_password, password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return run_password_job(verify_password, self.password_hash, password)
+
+    def upgrade_password_hash(self, password) -> bool:
+        """After a successful login, re-hash with the current method/cost if the stored one is older."""
+        if not password_needs_rehash(self.password_hash):
+            return False
+        self.set_password(password)
+        return True
 
 
 class Order(db.Model):
@@ -106,11 +367,73 @@ class Order(db.Model):
     payment_method = db.Column(db.String(20), default="COD")  # COD or ONLINE
     payment_status = db.Column(db.String(20), default="Pending")  # Pending, Paid, Failed
     notes = db.Column(db.Text)
+    # one key per rendered order form; replayed POSTs resolve to the same row
+    idempotency_key = db.Column(db.String(64), unique=True, nullable=True)
+    reserved_day = db.Column(db.Date, nullable=True)  # day whose capacity this order holds; NULL once released
+    route_key = db.Column(db.String(60), index=True)   # delivery area/pincode, see route_key_for_address()
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    items = db.relationship("OrderItem", backref="order", lazy=True, order_by="OrderItem.id",
+                            cascade="all, delete-orphan")
+
     def __repr__(self):
         return f"<Order {self.id} {self.customer_name} {self.product} x {self.quantity}>"
 
+
+class OrderItem(db.Model):
+    """One product line of an order; prices are copied from the catalog at checkout."""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False, index=True)
+    product = db.Column(db.String(120), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    unit_price = db.Column(db.Integer, nullable=False, default=0)
+    line_total = db.Column(db.Integer, nullable=False, default=0)
+
+class ProductCapacity(db.Model):
+    """Remaining production for one product on one day. Decremented in place, never read-then-written."""
+    id = db.Column(db.Integer, primary_key=True)
+    product = db.Column(db.String(120), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    capacity = db.Column(db.Integer, nullable=False)
+    remaining = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint("product", "day", name="uq_product_capacity_day"),)
+
+
+class Broadcast(db.Model):
+    """One WhatsApp announcement run; last_order_id is the resume checkpoint."""
+    id = db.Column(db.Integer, primary_key=True)
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="running")  # running, done
+    last_order_id = db.Column(db.Integer, default=0)
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)  # invalid numbers / duplicates
+    seconds = db.Column(db.Float, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+class BroadcastDelivery(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey("broadcast.id"), nullable=False)
+    phone = db.Column(db.String(30), nullable=False)   # normalized +<country><number>
+    status = db.Column(db.String(20), default="pending")  # pending, sent, failed
+    sid = db.Column(db.String(64))
+    error = db.Column(db.String(200))
+
+    # one message per number per broadcast, even across resumes
+    __table_args__ = (db.UniqueConstraint("broadcast_id", "phone", name="uq_broadcast_phone"),)
+
+
+class OrderEvent(db.Model):
+    """Append-only change log behind the admin live order feed (id is the feed cursor)."""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False)  # no FK: events outlive deleted orders
+    kind = db.Column(db.String(20), nullable=False)   # created, status, payment, deleted
+    payload = db.Column(db.Text, nullable=False)      # JSON snapshot of the order row
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 # -------------------------
 # PRODUCTS
 # -------------------------
@@ -151,6 +474,171 @@ def login_required(f):
 def find_product_price(name):
     return next((p["price"] for p in PRODUCTS if p["name"] == name), 0)
 
+def cart_lines_from_form(form):
+    """Build priced order lines from the order form in one pass over the catalog.
+
+    Reads qty_<product id> fields; the old single product/quantity pair still works.
+    Unknown products and zero quantities are dropped.
+    """
+    lines = []
+    for p in PRODUCTS:
+        try:
+            qty = int(form.get(f"qty_{p['id']}", "0").strip() or 0)
+        except ValueError:
+            qty = 0
+        if qty > 0:
+            lines.append({"product": p["name"], "quantity": qty,
+                          "unit_price": p["price"], "line_total": p["price"] * qty})
+    if not lines and form.get("product"):
+        catalog = {p["name"]: p["price"] for p in PRODUCTS}
+        name = form.get("product", "").strip()
+        try:
+            qty = max(1, int(form.get("quantity", "1").strip()))
+        except ValueError:
+            qty = 1
+        if name in catalog:
+            lines.append({"product": name, "quantity": qty,
+                          "unit_price": catalog[name], "line_total": catalog[name] * qty})
+    return lines
+
+PINCODE_RE = re.compile(r"\b(\d{3})\s?(\d{3})\b")
+
+def route_key_for_address(address) -> str:
+    """Group key for delivery rounds: the 6-digit PIN if present, else the locality part.
+
+    "12 MG Road, Gandhi Nagar, Vijayawada 520003" -> "PIN 520003";
+    "Flat 4, Lake view colony,  Guntur" -> "Lake View Colony".
+    """
+    if not address:
+        return ""
+    m = PINCODE_RE.search(address)
+    if m:
+        return f"PIN {m.group(1)}{m.group(2)}"
+    parts = [p.strip() for p in re.split(r"[,\n]+", address) if p.strip()]
+    if not parts:
+        return ""
+    # street/house first, city last: the locality is usually the one before the city
+    area = parts[-2] if len(parts) >= 2 else parts[0]
+    area = re.sub(r"[^\w\s-]", "", area)
+    return " ".join(area.split()).title()[:60]
+
+def order_summary(lines) -> str:
+    """Short text for Order.product, e.g. 'Paneer (200g) x2, Curd (200g) x1'."""
+    if len(lines) == 1:
+        return lines[0]["product"]
+    text = ", ".join(f"{l['product']} x{l['quantity']}" for l in lines)
+    return text if len(text) <= 120 else text[:117] + "..."
+
+def order_lines(order: Order):
+    """(product, quantity) pairs for an order; pre-cart orders fall back to the header."""
+    if order.items:
+        return [(i.product, i.quantity) for i in order.items]
+    return [(order.product, order.quantity)]
+
+def order_lines_text(order: Order) -> str:
+    if order.items:
+        return "\n".join(f"- {i.product} x{i.quantity} = ₹{i.line_total}" for i in order.items)
+    return f"- {order.product} x{order.quantity}"
+
+def new_idempotency_key() -> str:
+    """Fresh key embedded in each rendered order form."""
+    return secrets.token_urlsafe(24)
+
+def find_order_by_idempotency_key(key, user_id):
+    if not key:
+        return None
+    return Order.query.filter_by(idempotency_key=key, user_id=user_id).first()
+
+def redirect_for_existing_order(order: Order):
+    """Send a replayed checkout to wherever the original POST went, without new writes."""
+    if order.payment_method == "ONLINE" and order.payment_status != "Paid":
+        return redirect(url_for("mock_pay", order_id=order.id))
+    return redirect(url_for("order_success", order_id=order.id))
+
+def ensure_capacity_row(product, day, capacity):
+    """Create the (product, day) row on first use; racing inserts are absorbed by the unique key."""
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    db.session.execute(
+        insert(ProductCapacity)
+        .values(product=product, day=day, capacity=capacity, remaining=capacity)
+        .on_conflict_do_nothing(index_elements=["product", "day"])
+    )
+
+def reserve_stock(product, quantity, day, capacity=None) -> bool:
+    """Take `quantity` units of `day`'s capacity in the caller's transaction.
+
+    A single conditional UPDATE (remaining >= qty) does the check and the decrement,
+    so parallel workers can never oversell and no table lock is needed.
+    """
+    capacity = capacity if capacity is not None else app.config["DAILY_CAPACITY"].get(product)
+    if capacity is None:
+        return True
+    ensure_capacity_row(product, day, capacity)
+    result = db.session.execute(
+        db.update(ProductCapacity)
+        .where(ProductCapacity.product == product, ProductCapacity.day == day,
+               ProductCapacity.remaining >= quantity)
+        .values(remaining=ProductCapacity.remaining - quantity)
+    )
+    return result.rowcount == 1
+
+def remaining_stock(product, day):
+    row = ProductCapacity.query.filter_by(product=product, day=day).first()
+    if row:
+        return row.remaining
+    return app.config["DAILY_CAPACITY"].get(product)
+
+def reserve_for_order(order: Order, lines=None):
+    """Reserve today's capacity for every limited line of an order.
+
+    Returns None on success, or the name of the first product that is short; the
+    caller must then roll back so lines already reserved are undone with it.
+    """
+    pairs = [(l["product"], l["quantity"]) for l in lines] if lines is not None else order_lines(order)
+    day = date.today()
+    limited = False
+    for product, quantity in pairs:
+        if product not in app.config["DAILY_CAPACITY"]:
+            continue
+        if not reserve_stock(product, quantity, day):
+            return product
+        limited = True
+    if limited:
+        order.reserved_day = day
+    return None
+
+def release_reservation(order: Order) -> bool:
+    """Give an order's units back. Clearing reserved_day first makes a second release a no-op."""
+    if order.reserved_day is None or order.id is None:
+        return False
+    day = order.reserved_day
+    cleared = Order.query.filter(Order.id == order.id, Order.reserved_day.isnot(None)).update(
+        {"reserved_day": None}, synchronize_session=False)
+    set_committed_value(order, "reserved_day", None)
+    if not cleared:
+        return False
+    for product, quantity in order_lines(order):
+        if product not in app.config["DAILY_CAPACITY"]:
+            continue
+        db.session.execute(
+            db.update(ProductCapacity)
+            .where(ProductCapacity.product == product, ProductCapacity.day == day)
+            .values(remaining=ProductCapacity.remaining + quantity)
+        )
+    return True
+
+def sold_out_redirect(product):
+    db.session.rollback()
+    left = remaining_stock(product, date.today()) or 0
+    if left:
+        flash(f"Sorry, only {left} x {product} left for today. Please reduce the quantity.", "error")
+    else:
+        flash(f"Sorry, {product} is sold out for today.", "error")
+    return redirect(url_for("order"))
+
 def send_email(subject: str, to_email: str, body: str) -> bool:
     host = app.config.get("EMAIL_HOST")
     port = app.config.get("EMAIL_PORT")
@@ -191,26 +679,300 @@ def send_whatsapp_via_twilio(to_phone: str, body_text: str) -> bool:
         print("Twilio error:", e)
         return False
 
+def order_event_payload(order: Order) -> dict:
+    return {
+        "id": order.id,
+        "customer_name": order.customer_name,
+        "customer_email": order.customer_email,
+        "user_id": order.user_id,
+        "phone": order.phone,
+        "product": order.product,
+        "quantity": order.quantity,
+        "total_price": order.total_price or 0,
+        "status": order.status,
+        "payment_method": order.payment_method,
+        "payment_status": order.payment_status,
+        "created_at": order.created_at.strftime("%d-%m-%Y %H:%M") if order.created_at else "",
+    }
+
+def record_order_event(order: Order, kind: str):
+    """Queue a change-log row in the caller's transaction; it lands with the same commit."""
+    db.session.add(OrderEvent(order_id=order.id, kind=kind, payload=json.dumps(order_event_payload(order))))
+    # cached status snapshot is dropped once this transaction commits
+    db.session.info.setdefault("changed_order_ids", set()).add(order.id)
+    # occasionally trim old events so the log stays small
+    if random.random() < 0.01:
+        cutoff = datetime.utcnow() - timedelta(days=app.config["ORDER_EVENT_RETENTION_DAYS"])
+        OrderEvent.query.filter(OrderEvent.created_at < cutoff).delete(synchronize_session=False)
+
 def notify_admin_new_order(order: Order):
-    admin_email = app.config.get("OWNER_EMAIL")
+    admin_email = get_owner_email()
     if admin_email:
-        body = f"New order #{order.id}\nCustomer: {order.customer_name}\nPhone: {order.phone}\nProduct: {order.product}\nQty: {order.quantity}\nTotal: ₹{order.total_price or 0}\nAddress:\n{order.address}"
+        body = f"New order #{order.id}\nCustomer: {order.customer_name}\nPhone: {order.phone}\nItems:\n{order_lines_text(order)}\nTotal: ₹{order.total_price or 0}\nAddress:\n{order.address}"
         send_email(f"New Order #{order.id}", admin_email, body)
 
 def notify_customer_on_status_change(order: Order):
     # email
     if order.customer_email:
-        body = f"Update for your order #{order.id}\nStatus: {order.status}\nProduct: {order.product}\nQty: {order.quantity}\nTotal: ₹{order.total_price or 0}\n\nThank you,\nMMVALI Farm"
+        body = f"Update for your order #{order.id}\nStatus: {order.status}\nItems:\n{order_lines_text(order)}\nTotal: ₹{order.total_price or 0}\n\nThank you,\nMMVALI Farm"
         send_email(f"Order #{order.id} status update", order.customer_email, body)
     # whatsapp via Twilio if configured
     # (we send a brief message; Twilio WhatsApp requires business approval in production)
     client = get_twilio_client()
     if client and order.phone:
-        text = f"Order #{order.id} status updated to {order.status}. Product: {order.product}. Total ₹{order.total_price or 0}."
+        text = f"Order #{order.id} status updated to {order.status}.\n{order_lines_text(order)}\nTotal ₹{order.total_price or 0}."
         sent = send_whatsapp_via_twilio(order.phone, text)
         if sent:
             print("WhatsApp update sent to customer via Twilio.")
 
+# -------------------------
+# RATE LIMITING
+# -------------------------
+class MemoryBucketStore:
+    """Per-process token buckets. Fine for a single worker or local dev."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1.0):
+        """Consume `cost` tokens from bucket `key`. Returns 0 if allowed, else seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+
+def connect_side_db(path, schema):
+    """Autocommit WAL connection to a small SQLite side file shared by all workers."""
+    con = sqlite3.connect(path, timeout=2, isolation_level=None, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute(schema)
+    return con
+
+
+class SQLiteBucketStore:
+    """Token buckets in a shared SQLite file so every gunicorn worker sees the same counts.
+
+    Kept out of the main database so limiter writes never contend with order writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = connect_side_db(self.path, "CREATE TABLE IF NOT EXISTS bucket "
+                                             "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            self._local.con = con
+        return con
+
+    def take(self, key, capacity, rate, cost=1.0):
+        con = self._conn()
+        now = time.time()
+        try:
+            # BEGIN IMMEDIATE takes the write lock up front so read-modify-write is atomic across workers
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            wait = 0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            con.execute("INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            # occasionally drop buckets idle for a day
+            if random.random() < 0.01:
+                con.execute("DELETE FROM bucket WHERE updated < ?", (now - 86400,))
+            con.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            # fail open: a locked or broken limiter file must not lock customers out of
+            # login and ordering; the worst case is a few unthrottled attempts
+            print("Rate limiter store unavailable, allowing request:", e)
+            return 0
+        except Exception:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        return wait
+
+
+_ratelimit_store = None
+
+def get_ratelimit_store():
+    global _ratelimit_store
+    if _ratelimit_store is None:
+        if app.config.get("RATELIMIT_BACKEND") == "sqlite":
+            _ratelimit_store = SQLiteBucketStore(app.config["RATELIMIT_DB"])
+        else:
+            _ratelimit_store = MemoryBucketStore()
+    return _ratelimit_store
+
+def too_many_requests(retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    return Response(
+        f"Too many requests. Please try again in {seconds} seconds.\n",
+        status=429, mimetype="text/plain", headers={"Retry-After": str(seconds)}
+    )
+
+def rate_limit(policy, account_field=None):
+    """Reject POSTs over the named policy with 429 before the view does any work.
+
+    Buckets are keyed by client IP and, when `account_field` is given, by that
+    form value too (email, order id), so one account can't be hammered from many IPs.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != "POST" or not app.config.get("RATELIMIT_ENABLED"):
+                return f(*args, **kwargs)
+            capacity, rate = app.config["RATELIMIT_POLICIES"][policy]
+            keys = [f"{policy}:ip:{request.remote_addr or '-'}"]
+            if account_field:
+                account = request.form.get(account_field, "").strip().lower()
+                if account:
+                    keys.append(f"{policy}:acct:{account}")
+            store = get_ratelimit_store()
+            wait = max(store.take(k, capacity, rate) for k in keys)
+            if wait:
+                return too_many_requests(wait)
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# -------------------------
+# ORDER STATUS CACHE
+# -------------------------
+class StatusSnapshotStore:
+    """Order snapshots (status, payment, total, lines...) in a shared SQLite side file.
+
+    Filled on first read, dropped after any commit that records an order event,
+    so every worker sees a change immediately and reads skip the main database.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _conn(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = connect_side_db(self.path, "CREATE TABLE IF NOT EXISTS order_snapshot "
+                                             "(order_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)")
+            self._local.con = con
+        return con
+
+    # The cache is only ever an optimisation: any sqlite3 error is logged and the caller
+    # carries on as if it missed, so a locked cache.db can't fail an already-committed request.
+    def get(self, order_id):
+        try:
+            row = self._conn().execute("SELECT data FROM order_snapshot WHERE order_id = ? AND updated > ?",
+                                       (order_id, time.time() - self.ttl)).fetchone()
+        except sqlite3.Error as e:
+            print("Status cache read failed, using the database:", e)
+            return None
+        return json.loads(row[0]) if row else None
+
+    def put(self, order_id, data):
+        now = time.time()
+        try:
+            con = self._conn()
+            con.execute("INSERT OR REPLACE INTO order_snapshot (order_id, data, updated) VALUES (?, ?, ?)",
+                        (order_id, json.dumps(data), now))
+            # occasionally drop expired rows: reads ignore them anyway, and they hold customer details
+            if random.random() < 0.01:
+                con.execute("DELETE FROM order_snapshot WHERE updated < ?", (now - self.ttl,))
+        except sqlite3.Error as e:
+            print("Status cache write failed:", e)
+
+    def delete(self, order_ids):
+        try:
+            self._conn().executemany("DELETE FROM order_snapshot WHERE order_id = ?", [(i,) for i in order_ids])
+        except sqlite3.Error as e:
+            # stale rows age out after STATUS_CACHE_TTL
+            print(f"Status cache invalidation failed for orders {sorted(order_ids)}:", e)
+
+
+status_cache = StatusSnapshotStore(app.config["STATUS_CACHE_DB"], app.config["STATUS_CACHE_TTL"])
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_status_snapshots(sess):
+    changed = sess.info.pop("changed_order_ids", None)
+    if changed:
+        status_cache.delete(changed)
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_status_changes(sess):
+    sess.info.pop("changed_order_ids", None)
+
+def order_snapshot(order: Order) -> dict:
+    return {
+        "id": order.id,
+        "customer_name": order.customer_name,
+        "customer_email": order.customer_email,
+        "user_id": order.user_id,
+        "phone": order.phone,
+        "address": order.address,
+        "product": order.product,
+        "quantity": order.quantity,
+        "total_price": order.total_price or 0,
+        "status": order.status,
+        "payment_method": order.payment_method,
+        "payment_status": order.payment_status,
+        "items": [{"product": i.product, "quantity": i.quantity, "line_total": i.line_total} for i in order.items],
+    }
+
+def get_order_snapshot(order_id):
+    """Cached snapshot dict for an order, or None if it doesn't exist."""
+    snap = status_cache.get(order_id)
+    if snap is None:
+        order = db.session.get(Order, order_id)
+        if order is None:
+            return None
+        snap = order_snapshot(order)
+        status_cache.put(order_id, snap)
+    return snap
+
+def snapshot_view(snap):
+    """Attribute-style wrapper so templates written against Order render a snapshot."""
+    view = SimpleNamespace(**snap)
+    view.items = [SimpleNamespace(**i) for i in snap["items"]]
+    return view
+
+_token_cache = OrderedDict()  # token -> (data or None, expires at)
+_token_cache_lock = threading.Lock()
+TOKEN_CACHE_SIZE = 2048
+
+def verify_tracking_token(token):
+    """serializer.loads() with a per-worker LRU; returns the payload or None if invalid/expired."""
+    now = time.time()
+    with _token_cache_lock:
+        hit = _token_cache.get(token)
+        if hit and hit[1] > now:
+            _token_cache.move_to_end(token)
+            return hit[0]
+    max_age = app.config["TRACKING_TOKEN_MAX_AGE"]
+    try:
+        data, signed_at = serializer.loads(token, max_age=max_age, return_timestamp=True)
+        expires = signed_at.timestamp() + max_age
+    except Exception:
+        data, expires = None, now + 300  # remember bad tokens briefly
+    with _token_cache_lock:
+        _token_cache[token] = (data, expires)
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return data
+
 # -------------------------
 # ROUTES
 # -------------------------
@@ -228,6 +990,7 @@ def about():
 
 # Registration / Login
 @app.route("/register", methods=["GET", "POST"])
+@rate_limit("register")
 def register():
     if request.method == "POST":
         name = request.form.get("name", "").strip()
@@ -251,6 +1014,7 @@ def register():
     return render_template("register.html")
 
 @app.route("/login", methods=["GET", "POST"])
+@rate_limit("login", account_field="email")
 def login():
     next_url = request.args.get("next")
     if request.method == "POST":
@@ -258,6 +1022,8 @@ def login():
         password = request.form.get("password", "")
         user = User.query.filter_by(email=email).first()
         if user and user.check_password(password):
+            if user.upgrade_password_hash(password):
+                db.session.commit()
             session["user_id"] = user.id
             session["user_email"] = user.email
             session["user_name"] = user.name
@@ -276,6 +1042,7 @@ def logout():
 
 # Password reset
 @app.route("/reset-request", methods=["GET", "POST"])
+@rate_limit("reset_request", account_field="email")
 def reset_request():
     if request.method == "POST":
         email = request.form.get("email", "").strip().lower()
@@ -324,97 +1091,123 @@ def order():
         name = request.form.get("name", "").strip()
         phone = request.form.get("phone", "").strip()
         address = request.form.get("address", "").strip()
-        product = request.form.get("product", "").strip()
-        quantity_raw = request.form.get("quantity", "1").strip()
         notes = request.form.get("notes", "").strip()
         payment_method = request.form.get("payment_method", "COD")  # COD or ONLINE
+        idempotency_key = request.form.get("idempotency_key", "").strip()[:64] or None
+
+        # double-submit / client retry: answer with the original order
+        existing = find_order_by_idempotency_key(idempotency_key, session.get("user_id"))
+        if existing:
+            return redirect_for_existing_order(existing)
 
         # validations
         if not name or not phone or not address:
             flash("Please fill name, phone and address.", "error")
             return redirect(url_for("order"))
 
-        try:
-            quantity = int(quantity_raw)
-            if quantity <= 0:
-                quantity = 1
-        except ValueError:
-            quantity = 1
-
-        unit_price = find_product_price(product)
-        total_price = unit_price * quantity
+        lines = cart_lines_from_form(request.form)
+        if not lines:
+            flash("Please choose at least one product.", "error")
+            return redirect(url_for("order"))
+        total_price = sum(line["line_total"] for line in lines)
 
         user_id = session.get("user_id")
         user_email = session.get("user_email")
 
-        # If payment_method == ONLINE -> redirect to pseudo-payment (simulate)
-        if payment_method == "ONLINE":
-            # create a temporary pending order record with payment_status pending
-            new_order = Order(
-                user_id=user_id,
-                customer_name=name,
-                customer_email=user_email,
-                phone=phone,
-                address=address,
-                product=product,
-                quantity=quantity,
-                total_price=total_price,
-                status="Pending",
-                payment_method="ONLINE",
-                payment_status="Pending",
-                notes=notes
-            )
-            db.session.add(new_order)
+        # one header row for the whole cart; product/quantity keep a readable summary
+        new_order = Order(
+            user_id=user_id,
+            customer_name=name,
+            customer_email=user_email,
+            phone=phone,
+            address=address,
+            route_key=route_key_for_address(address),
+            product=order_summary(lines),
+            quantity=sum(line["quantity"] for line in lines),
+            total_price=total_price,
+            status="Pending",
+            payment_method="ONLINE" if payment_method == "ONLINE" else "COD",
+            payment_status="Pending",
+            notes=notes,
+            idempotency_key=idempotency_key
+        )
+        sold_out = reserve_for_order(new_order, lines)
+        if sold_out:
+            return sold_out_redirect(sold_out)
+        db.session.add(new_order)
+        try:
+            db.session.flush()
+            # header + all lines + event land in this one transaction
+            db.session.execute(db.insert(OrderItem), [dict(line, order_id=new_order.id) for line in lines])
+            record_order_event(new_order, "created")
             db.session.commit()
+        except IntegrityError:
+            # a concurrent duplicate POST won the insert
+            db.session.rollback()
+            existing = find_order_by_idempotency_key(idempotency_key, user_id)
+            if not existing:
+                raise
+            return redirect_for_existing_order(existing)
+
+        # If payment_method == ONLINE -> redirect to pseudo-payment (simulate)
+        if new_order.payment_method == "ONLINE":
             # In real app: redirect to payment gateway with order id and amount
             # → For now we simulate payment page where user "pays" and we set payment_status accordingly
             return redirect(url_for("mock_pay", order_id=new_order.id))
-        else:
-            # COD: create order with payment_status 'Pending' and payment_method COD
-            new_order = Order(
-                user_id=user_id,
-                customer_name=name,
-                customer_email=user_email,
-                phone=phone,
-                address=address,
-                product=product,
-                quantity=quantity,
-                total_price=total_price,
-                status="Pending",
-                payment_method="COD",
-                payment_status="Pending",
-                notes=notes
-            )
-            db.session.add(new_order)
-            db.session.commit()
 
-            # notify admin and customer
-            notify_admin_new_order(new_order)
-            # send email with tracking link if email present
-            if new_order.customer_email:
-                token = serializer.dumps({"order_id": new_order.id, "email": new_order.customer_email})
-                link = url_for("order_success", order_id=new_order.id, token=token, _external=True)
-                body = f"Thanks for your order #{new_order.id}\nTrack: {link}\nPayment: Cash on Delivery\nPayment instructions (if you want to pay online):\n{app.config['PAYMENT_INSTRUCTIONS']['bank_account']}\nUPI: {app.config['PAYMENT_INSTRUCTIONS']['upi']}"
-                send_email(f"Order #{new_order.id} - MMVALI Farm", new_order.customer_email, body)
+        # COD: notify admin and customer
+        notify_admin_new_order(new_order)
+        # send email with tracking link if email present
+        if new_order.customer_email:
+            token = serializer.dumps({"order_id": new_order.id, "email": new_order.customer_email})
+            link = url_for("order_success", order_id=new_order.id, token=token, _external=True)
+            payment_info = get_payment_instructions()
+            body = f"Thanks for your order #{new_order.id}\n{order_lines_text(new_order)}\nTotal: ₹{new_order.total_price or 0}\nTrack: {link}\nPayment: Cash on Delivery\nPayment instructions (if you want to pay online):\n{payment_info['bank_account']}\nUPI: {payment_info['upi']}"
+            send_email(f"Order #{new_order.id} - MMVALI Farm", new_order.customer_email, body)
 
-            flash("Order placed. Check your profile or email for tracking details.", "success")
-            return redirect(url_for("order_success", order_id=new_order.id))
+        flash("Order placed. Check your profile or email for tracking details.", "success")
+        return redirect(url_for("order_success", order_id=new_order.id))
 
-    # GET prefill user info
+    # GET prefill user info (?product=<name> from the product cards preselects one unit)
     user = User.query.get(session.get("user_id"))
-    return render_template("order.html", products=PRODUCTS, user=user, payment_info=app.config["PAYMENT_INSTRUCTIONS"])
+    return render_template("order.html", products=PRODUCTS, user=user, payment_info=get_payment_instructions(),
+                           idempotency_key=new_idempotency_key(), selected=request.args.get("product", ""))
 
 # Mock payment simulation page - in real integrate with a real gateway
 @app.route("/mock-pay/<int:order_id>", methods=["GET", "POST"])
 @login_required
 def mock_pay(order_id):
     order = Order.query.get_or_404(order_id)
+    if order.payment_status == "Expired":
+        flash("This payment session expired. Please place the order again.", "error")
+        return redirect(url_for("order"))
     if request.method == "POST":
         action = request.form.get("action")
         if action == "success":
-            order.payment_status = "Paid"
-            order.status = "Paid"
+            # a failed attempt released its stock; take it again before confirming.
+            # Claim the re-reservation with a conditional UPDATE first (as release_reservation
+            # does) so a double-tapped retry only takes the units once.
+            limited = any(p in app.config["DAILY_CAPACITY"] for p, _ in order_lines(order))
+            if order.payment_status == "Failed" and order.reserved_day is None and limited:
+                claimed = Order.query.filter(
+                    Order.id == order.id, Order.reserved_day.is_(None), Order.payment_status == "Failed"
+                ).update({"reserved_day": date.today()}, synchronize_session=False)
+                sold_out = reserve_for_order(order) if claimed else None
+                if sold_out:
+                    db.session.rollback()
+                    flash(f"Sorry, {sold_out} sold out before payment completed.", "error")
+                    return redirect(url_for("order"))
+            # conditional update: only the first confirmation flips the row and notifies,
+            # and a payment racing the abandoned-order sweeper can't revive an expired order
+            updated = Order.query.filter(
+                Order.id == order.id, Order.payment_status.in_(("Pending", "Failed"))
+            ).update({"payment_status": "Paid", "status": "Paid"}, synchronize_session=False)
+            if updated:
+                db.session.refresh(order)
+                record_order_event(order, "payment")
             db.session.commit()
+            if not updated:
+                return redirect(url_for("order_success", order_id=order.id))
             notify_admin_new_order(order)
             # notify customer via email
             if order.customer_email:
@@ -425,7 +1218,16 @@ def mock_pay(order_id):
             flash("Payment successful. Order confirmed.", "success")
             return redirect(url_for("order_success", order_id=order.id))
         else:
-            order.payment_status = "Failed"
+            # conditional too: a success that committed first must not be overwritten with Failed
+            updated = Order.query.filter(
+                Order.id == order.id, Order.payment_status.in_(("Pending", "Failed"))
+            ).update({"payment_status": "Failed"}, synchronize_session=False)
+            if not updated:
+                db.session.rollback()
+                return redirect(url_for("order_success", order_id=order.id))
+            db.session.refresh(order)
+            release_reservation(order)
+            record_order_event(order, "payment")
             db.session.commit()
             flash("Payment failed. You can try again or choose Cash on Delivery.", "error")
             return redirect(url_for("order"))
@@ -434,20 +1236,38 @@ def mock_pay(order_id):
 @app.route("/order/success/<int:order_id>")
 def order_success(order_id):
     token = request.args.get("token")
-    order = Order.query.get_or_404(order_id)
+    snap = get_order_snapshot(order_id)
+    if snap is None:
+        abort(404)
     # token optional: if present, validate for safety (useful for guest link)
     if token:
-        try:
-            data = serializer.loads(token, max_age=60*60*24*30)  # 30 days
-            if data.get("order_id") != order.id:
-                flash("Invalid tracking token.", "error")
-                return redirect(url_for("track"))
-        except Exception:
+        data = verify_tracking_token(token)
+        if data is None:
             flash("Invalid or expired tracking link.", "error")
             return redirect(url_for("track"))
-    return render_template("order_success.html", order=order, payment_info=app.config["PAYMENT_INSTRUCTIONS"])
+        if data.get("order_id") != snap["id"]:
+            flash("Invalid tracking token.", "error")
+            return redirect(url_for("track"))
+    return render_template("order_success.html", order=snapshot_view(snap), payment_info=get_payment_instructions(),
+                           status_url=url_for("order_status_json", order_id=order_id, token=token))
+
+@app.route("/order/<int:order_id>/status.json")
+def order_status_json(order_id):
+    """Cheap polling endpoint: needs the tracking token or the owning user's session."""
+    snap = get_order_snapshot(order_id)
+    if snap is None:
+        abort(404)
+    token = request.args.get("token")
+    data = verify_tracking_token(token) if token else None
+    owner = session.get("user_id") and snap["user_id"] == session.get("user_id")
+    if not owner and not (data and data.get("order_id") == snap["id"]):
+        abort(403)
+    resp = jsonify({k: snap[k] for k in ("id", "status", "payment_status", "total_price")})
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 @app.route("/track", methods=["GET", "POST"])
+@rate_limit("track", account_field="order_id")
 def track():
     result = None
     error = None
@@ -463,21 +1283,21 @@ def track():
         except ValueError:
             error = "Order ID must be a number."
             return render_template("track.html", result=None, error=error)
-        order = Order.query.get(oid)
+        order = get_order_snapshot(oid)
         if not order:
             error = "Order not found. Check the ID."
         else:
             ok = False
-            if phone and phone == order.phone:
+            if phone and phone == order["phone"]:
                 ok = True
-            if email and order.customer_email and email == order.customer_email:
+            if email and order["customer_email"] and email == order["customer_email"]:
                 ok = True
-            if session.get("user_id") and order.user_id == session.get("user_id"):
+            if session.get("user_id") and order["user_id"] == session.get("user_id"):
                 ok = True
             if not ok:
                 error = "Verification failed. Provide the phone or email used when ordering or log in."
             else:
-                result = order
+                result = snapshot_view(order)
     return render_template("track.html", result=result, error=error)
 
 # -------------------------
@@ -507,8 +1327,33 @@ def admin_logout():
 @app.route("/admin/orders")
 @admin_login_required
 def admin_orders():
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template("admin_orders.html", orders=orders)
+    query = Order.query
+    show_expired = request.args.get("expired") == "1"
+    if not show_expired:
+        query = query.filter(db.or_(Order.payment_status.is_(None), Order.payment_status != "Expired"))
+    orders = query.order_by(Order.created_at.desc()).all()
+    last_event_id = db.session.query(db.func.max(OrderEvent.id)).scalar() or 0
+    return render_template("admin_orders.html", orders=orders, last_event_id=last_event_id,
+                           show_expired=show_expired,
+                           poll_ms=app.config["ORDER_FEED_POLL_SECONDS"] * 1000)
+
+@app.route("/admin/orders/changes")
+@admin_login_required
+def admin_orders_changes():
+    """Order changes after ?after=<event id>, read from the OrderEvent log.
+
+    A primary-key range scan, so the page can poll it every few seconds for ~nothing.
+    """
+    try:
+        after = int(request.args.get("after", ""))
+    except ValueError:
+        after = db.session.query(db.func.max(OrderEvent.id)).scalar() or 0
+    events = (OrderEvent.query.filter(OrderEvent.id > after)
+              .order_by(OrderEvent.id).limit(app.config["ORDER_FEED_BATCH"]).all())
+    return jsonify({
+        "events": [{"id": ev.id, "kind": ev.kind, "order": json.loads(ev.payload)} for ev in events],
+        "last_id": events[-1].id if events else after,
+    })
 
 @app.route("/admin/orders/<int:order_id>/status", methods=["POST"])
 @admin_login_required
@@ -517,8 +1362,18 @@ def admin_update_status(order_id):
     new_status = request.form.get("status", "Pending")
     if new_status not in ["Pending", "Processing", "Paid", "Delivered", "Cancelled"]:
         new_status = "Pending"
+    # reviving a cancelled order takes its units again; cancelling gave them back
+    if order.status == "Cancelled" and new_status != "Cancelled" and order.reserved_day is None:
+        sold_out = reserve_for_order(order)
+        if sold_out:
+            db.session.rollback()
+            flash(f"Order #{order.id} not updated: {sold_out} is sold out for today.", "error")
+            return redirect(url_for("admin_orders"))
     order.status = new_status
+    if new_status == "Cancelled":
+        release_reservation(order)
     # if delivered and admin wants to auto-delete, we don't delete automatically here; admin may delete
+    record_order_event(order, "status")
     db.session.commit()
     notify_customer_on_status_change(order)
     flash(f"Order #{order.id} status updated to {new_status}.", "success")
@@ -531,7 +1386,7 @@ def admin_order_whatsapp_owner(order_id):
     msg_link = build_whatsapp_link_owner(order := order)  # not used; we'll redirect to wa.me, simpler:
     # use wa.me link (opens WhatsApp)
     text = f"New order #{order.id} - {order.product} x{order.quantity}. Customer: {order.customer_name}. Phone: {order.phone}"
-    phone = app.config.get("OWNER_WHATSAPP", "").lstrip("+")
+    phone = get_owner_whatsapp().lstrip("+")
     link = f"https://wa.me/{phone}?text={urllib.parse.quote(text)}"
     return redirect(link)
 
@@ -559,6 +1414,9 @@ def admin_order_whatsapp_user(order_id):
 @admin_login_required
 def admin_delete_order(order_id):
     order = Order.query.get_or_404(order_id)
+    record_order_event(order, "deleted")
+    if order.status not in ("Delivered", "Cancelled"):
+        release_reservation(order)
     db.session.delete(order)
     db.session.commit()
     flash(f"Order #{order_id} deleted.", "success")
@@ -595,6 +1453,87 @@ def admin_export_orders():
     response = Response(csv_data, mimetype="text/csv", headers={"Content-Disposition": "attachment; filename=orders.csv"})
     return response
 
+# --- Delivery manifest ---
+MANIFEST_STATUSES = ("Pending", "Processing", "Paid")
+
+def manifest_query(day):
+    """Open orders placed up to the end of `day`, one row per order line, in route order.
+
+    yield_per streams rows (a server-side cursor on Postgres), so memory stays flat.
+    """
+    day_end = datetime.combine(day + timedelta(days=1), datetime.min.time())
+    return (db.session.query(
+                Order.id, Order.customer_name, Order.phone, Order.address, Order.route_key,
+                Order.status, Order.payment_method, Order.payment_status, Order.total_price,
+                Order.notes, Order.product, Order.quantity,
+                OrderItem.product.label("item_product"), OrderItem.quantity.label("item_quantity"))
+            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+            .filter(Order.status.in_(MANIFEST_STATUSES), Order.created_at < day_end,
+                    # unpaid online checkouts (pending or failed) don't go on the van
+                    db.or_(Order.payment_method != "ONLINE", Order.payment_status == "Paid"))
+            .order_by(db.func.coalesce(Order.route_key, ""), Order.id, OrderItem.id)
+            .yield_per(500))
+
+def _manifest_stops(rows, route, grand_totals):
+    for _, order_rows in groupby(rows, key=lambda r: r.id):
+        order_rows = list(order_rows)  # one order's lines
+        first = order_rows[0]
+        lines = [(r.item_product or r.product, r.item_quantity or r.quantity) for r in order_rows]
+        for product, qty in lines:
+            route.totals[product] = route.totals.get(product, 0) + qty
+            grand_totals[product] = grand_totals.get(product, 0) + qty
+        route.count += 1
+        yield SimpleNamespace(id=first.id, customer_name=first.customer_name, phone=first.phone,
+                              address=first.address, status=first.status,
+                              payment=f"{first.payment_method or 'COD'} / {first.payment_status or 'Pending'}",
+                              total_price=first.total_price or 0, notes=first.notes or "", lines=lines)
+
+def iter_manifest_routes(rows, grand_totals):
+    """Lazily group streamed rows into routes -> stops. Route totals fill in as stops are consumed."""
+    for key, route_rows in groupby(rows, key=lambda r: r.route_key or ""):
+        route = SimpleNamespace(name=key or "Unassigned", totals={}, count=0)
+        route.stops = _manifest_stops(route_rows, route, grand_totals)
+        yield route
+
+def manifest_csv(routes):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def flush():
+        data = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return data
+
+    writer.writerow(["Route", "OrderID", "Customer", "Phone", "Address", "Product", "Quantity",
+                     "OrderTotal", "Status", "Payment", "Notes"])
+    yield flush()
+    for route in routes:
+        for stop in route.stops:
+            for product, qty in stop.lines:
+                writer.writerow([route.name, stop.id, stop.customer_name, stop.phone,
+                                 stop.address.replace("\n", " "), product, qty, stop.total_price,
+                                 stop.status, stop.payment, stop.notes.replace("\n", " ")])
+            yield flush()
+        for product, qty in route.totals.items():
+            writer.writerow([route.name, "ROUTE TOTAL", "", "", "", product, qty, "", "", "", ""])
+        yield flush()
+
+@app.route("/admin/manifest")
+@admin_login_required
+def admin_manifest():
+    """Printable delivery manifest grouped by route (?day=YYYY-MM-DD, ?format=csv)."""
+    try:
+        day = datetime.strptime(request.args.get("day", ""), "%Y-%m-%d").date()
+    except ValueError:
+        day = date.today()
+    grand_totals = {}
+    routes = iter_manifest_routes(manifest_query(day), grand_totals)
+    if request.args.get("format") == "csv":
+        return Response(stream_with_context(manifest_csv(routes)), mimetype="text/csv",
+                        headers={"Content-Disposition": f"attachment; filename=manifest-{day}.csv"})
+    return Response(stream_template("admin_manifest.html", day=day, routes=routes, grand_totals=grand_totals))
+
 # -------------------------
 # PROFILE
 # -------------------------
@@ -610,7 +1549,7 @@ def profile():
 # -------------------------
 def build_whatsapp_link_owner(order: Order) -> str:
     text = f"New order #{order.id} - {order.product} x{order.quantity}. Customer: {order.customer_name}. Phone: {order.phone}"
-    phone = app.config.get("OWNER_WHATSAPP", "").lstrip("+")
+    phone = get_owner_whatsapp().lstrip("+")
     return f"https://wa.me/{phone}?text={urllib.parse.quote(text)}"
 
 # -------------------------
@@ -631,7 +1570,6 @@ def refund():
 # -------------------------
 
 # --- Admin product/settings helpers (paste into app.py) ---
-import json
 
 PRODUCTS_JSON = os.path.join(INSTANCE_DIR, "products.json")
 SETTINGS_JSON = os.path.join(INSTANCE_DIR, "settings.json")
@@ -666,26 +1604,97 @@ def ensure_settings_file():
         with open(SETTINGS_JSON, "w", encoding="utf-8") as f:
             json.dump(default, f, indent=2)
 
+
+class SettingsService:
+    """Per-worker parsed copy of settings.json.
+
+    Readers get the cached dict (treat it as read-only). At most once every
+    `check_interval` seconds a worker stat()s the file and reloads if its
+    mtime/size/inode changed, so a save in one worker reaches all the others
+    without a restart, and the request path normally does no file I/O at all.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._data = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stat_version(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _reload(self):
+        ensure_settings_file()
+        version = self._stat_version()
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._data, self._version = data, version
+
+    def get(self) -> dict:
+        now = time.monotonic()
+        if self._data is not None and now - self._checked_at < self.check_interval:
+            return self._data
+        with self._lock:
+            if self._data is None or now - self._checked_at >= self.check_interval:
+                try:
+                    if self._data is None or self._stat_version() != self._version:
+                        self._reload()
+                except (OSError, ValueError) as e:
+                    # missing/half-written file: keep serving the last good copy
+                    print("settings reload failed:", e)
+                    if self._data is None:
+                        self._data = {}
+                self._checked_at = now
+        return self._data
+
+    def save(self, settings: dict):
+        # write-then-rename so other workers never parse a half-written file
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(settings, f, indent=2)
+        os.replace(tmp, self.path)
+        with self._lock:
+            self._data, self._version = settings, self._stat_version()
+            self._checked_at = time.monotonic()
+
+
+settings_service = SettingsService(SETTINGS_JSON, app.config["SETTINGS_CHECK_SECONDS"])
+
 def load_settings():
-    ensure_settings_file()
-    with open(SETTINGS_JSON, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """Editable copy of the current settings."""
+    return copy.deepcopy(settings_service.get())
 
 def save_settings(settings):
-    with open(SETTINGS_JSON, "w", encoding="utf-8") as f:
-        json.dump(settings, f, indent=2)
+    settings_service.save(settings)
+
+def get_payment_instructions() -> dict:
+    """Payment instructions from settings, falling back to the built-in defaults per field."""
+    return {**app.config["PAYMENT_INSTRUCTIONS"], **(settings_service.get().get("payment_instructions") or {})}
+
+def get_owner_email() -> str:
+    return settings_service.get().get("owner_email") or app.config.get("OWNER_EMAIL", "")
+
+def get_owner_whatsapp() -> str:
+    return settings_service.get().get("owner_whatsapp") or app.config.get("OWNER_WHATSAPP", "")
 
 # --- Admin Dashboard route ---
 @app.route("/admin")
 @admin_login_required
 def admin_dashboard():
     # summary metrics
-    total_orders = Order.query.count()
+    # abandoned online checkouts expired by the sweeper don't count
+    live = Order.query.filter(db.or_(Order.payment_status.is_(None), Order.payment_status != "Expired"))
+    total_orders = live.count()
     total_users = User.query.count()
-    total_revenue = db.session.query(db.func.sum(Order.total_price)).scalar() or 0
-    recent_orders = Order.query.order_by(Order.created_at.desc()).limit(6).all()
+    total_revenue = (db.session.query(db.func.sum(Order.total_price))
+                     .filter(db.or_(Order.payment_status.is_(None), Order.payment_status != "Expired"))
+                     .scalar() or 0)
+    recent_orders = live.order_by(Order.created_at.desc()).limit(6).all()
     products = load_products()
-    settings = load_settings()
+    settings = settings_service.get()
     return render_template(
         "admin_dashboard.html",
         total_orders=total_orders,
@@ -765,8 +1774,364 @@ def admin_settings():
         save_settings(settings)
         flash("Settings updated.", "success")
         return redirect(url_for("admin_settings"))
-    settings = load_settings()
+    settings = settings_service.get()
     return render_template("admin_settings.html", settings=settings)
 
+# -------------------------
+# BROADCASTS
+# -------------------------
+def normalize_phone(raw):
+    """Best-effort E.164 for Indian numbers: '98765 43210', '098765...', '91987...' -> '+91987...'."""
+    if not raw:
+        return None
+    raw = str(raw).strip()
+    digits = "".join(ch for ch in raw if ch.isdigit())
+    if raw.startswith("+"):
+        return "+" + digits if len(digits) >= 10 else None
+    if len(digits) == 10:
+        return "+91" + digits
+    if len(digits) == 11 and digits.startswith("0"):
+        return "+91" + digits[1:]
+    if len(digits) == 12 and digits.startswith("91"):
+        return "+" + digits
+    return None
+
+def twilio_send_message(to_phone, body_text, timeout=10):
+    """POST one WhatsApp message to the Twilio REST API at TWILIO_API_BASE.
+
+    Returns (ok, sid_or_error, retry_after); retry_after is set when Twilio answers 429.
+    """
+    sid = app.config.get("TWILIO_ACCOUNT_SID")
+    token = app.config.get("TWILIO_AUTH_TOKEN")
+    if not sid or not token:
+        return False, "Twilio not configured", None
+    url = f"{app.config['TWILIO_API_BASE'].rstrip('/')}/2010-04-01/Accounts/{sid}/Messages.json"
+    data = urllib.parse.urlencode({
+        "From": app.config.get("TWILIO_WHATSAPP_FROM"),
+        "To": f"whatsapp:{to_phone}",
+        "Body": body_text,
+    }).encode()
+    auth = base64.b64encode(f"{sid}:{token}".encode()).decode()
+    req = urllib.request.Request(url, data=data, headers={"Authorization": f"Basic {auth}"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return True, json.loads(resp.read().decode()).get("sid", ""), None
+    except urllib.error.HTTPError as e:
+        if e.code == 429:
+            return False, "rate limited", float(e.headers.get("Retry-After") or 1)
+        return False, f"HTTP {e.code}: {e.read()[:150].decode(errors='replace')}", None
+    except Exception as e:
+        return False, str(e)[:200], None
+
+def iter_broadcast_recipients(after_order_id, chunk_size):
+    """Yield (last_order_id, [normalized phones]) chunks from Order rows, keyset-paginated by id."""
+    last_id = after_order_id
+    while True:
+        rows = (db.session.query(Order.id, Order.phone)
+                .filter(Order.id > last_id).order_by(Order.id).limit(chunk_size).all())
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield last_id, [normalize_phone(r.phone) for r in rows]
+
+def broadcast_pending_count(broadcast: Broadcast) -> int:
+    """Numbers claimed by a run that crashed before recording the result; they may or may not have been sent."""
+    return BroadcastDelivery.query.filter_by(broadcast_id=broadcast.id, status="pending").count()
+
+def run_broadcast(broadcast: Broadcast, send=None, retry_pending=False):
+    """Send `broadcast.message` to every distinct customer phone, resuming from its checkpoint.
+
+    Main thread reads recipients and writes results; a small pool only does HTTP.
+    Each chunk's numbers are claimed (pending rows) and committed before sending,
+    so a crash never causes a double send - unfinished claims stay 'pending' and are
+    only sent again with retry_pending (those customers may get the message twice).
+    """
+    send = send or twilio_send_message
+    message = broadcast.message  # read once: pool threads have no app context
+    bucket = MemoryBucketStore()
+    rate = float(app.config["BROADCAST_RATE_PER_SECOND"])
+    burst = max(1.0, rate)
+
+    def deliver(phone):
+        for _ in range(5):
+            wait = bucket.take("broadcast", burst, rate)
+            while wait:
+                time.sleep(wait)
+                wait = bucket.take("broadcast", burst, rate)
+            ok, info, retry_after = send(phone, message)
+            if retry_after is None:
+                return phone, ok, info
+            time.sleep(retry_after)
+        return phone, False, "rate limited"
+
+    def record(results):
+        for phone, ok, info in results:
+            BroadcastDelivery.query.filter_by(broadcast_id=broadcast.id, phone=phone).update({
+                "status": "sent" if ok else "failed",
+                "sid": info if ok else None,
+                "error": None if ok else info,
+            }, synchronize_session=False)
+        broadcast.sent += sum(1 for _, ok, _ in results if ok)
+        broadcast.failed += sum(1 for _, ok, _ in results if not ok)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=app.config["BROADCAST_CONCURRENCY"]) as pool:
+        retried = set()
+        if retry_pending:
+            chunk = app.config["BROADCAST_CHUNK_SIZE"]
+            while True:
+                pending = [d.phone for d in BroadcastDelivery.query.with_entities(BroadcastDelivery.phone)
+                           .filter(BroadcastDelivery.broadcast_id == broadcast.id,
+                                   BroadcastDelivery.status == "pending")
+                           .limit(chunk)]
+                if not pending:
+                    break
+                retried.update(pending)
+                record(list(pool.map(deliver, pending)))
+                db.session.commit()
+            if retried:
+                print(f"broadcast #{broadcast.id}: retried {len(retried)} pending number(s)")
+
+        for last_id, phones in iter_broadcast_recipients(broadcast.last_order_id, app.config["BROADCAST_CHUNK_SIZE"]):
+            valid = [p for p in phones if p]
+            fresh = list(dict.fromkeys(valid))
+            already = {}
+            if fresh:
+                already = dict(BroadcastDelivery.query
+                               .with_entities(BroadcastDelivery.phone, BroadcastDelivery.status)
+                               .filter(BroadcastDelivery.broadcast_id == broadcast.id,
+                                       BroadcastDelivery.phone.in_(fresh)))
+            todo = [p for p in fresh if p not in already]
+            # unconfirmed claims and numbers just retried are reported on their own, not as skipped
+            unresolved = sum(1 for p in fresh if already.get(p) == "pending" or p in retried)
+            broadcast.skipped += len(phones) - len(todo) - unresolved
+            db.session.bulk_insert_mappings(BroadcastDelivery, [
+                {"broadcast_id": broadcast.id, "phone": p, "status": "pending"} for p in todo])
+            db.session.commit()
+
+            record(list(pool.map(deliver, todo)))
+            broadcast.last_order_id = last_id
+            broadcast.seconds = (broadcast.seconds or 0) + (time.monotonic() - start)
+            start = time.monotonic()
+            db.session.commit()
+            print(f"broadcast #{broadcast.id}: through order {last_id} - "
+                  f"sent {broadcast.sent}, failed {broadcast.failed}, skipped {broadcast.skipped}")
+    broadcast.status = "done"
+    broadcast.finished_at = datetime.utcnow()
+    db.session.commit()
+    return broadcast
+
+@app.cli.command("broadcast")
+@click.argument("message", required=False)
+@click.option("--resume", "resume_id", type=int, help="continue an interrupted broadcast by id")
+@click.option("--retry-pending", is_flag=True,
+              help="with --resume, also send to numbers a crashed run claimed but never confirmed "
+                   "(some of them may get the message twice)")
+@click.option("--rate", type=float, help="messages per second (default BROADCAST_RATE_PER_SECOND)")
+@click.option("--concurrency", type=int, help="parallel sends (default BROADCAST_CONCURRENCY)")
+def broadcast_command(message, resume_id, retry_pending, rate, concurrency):
+    """Send MESSAGE on WhatsApp to every customer who has ordered (deduped by phone)."""
+    if retry_pending and not resume_id:
+        raise click.ClickException("--retry-pending needs --resume ID")
+    if rate:
+        app.config["BROADCAST_RATE_PER_SECOND"] = rate
+    if concurrency:
+        app.config["BROADCAST_CONCURRENCY"] = concurrency
+    if resume_id:
+        broadcast = db.session.get(Broadcast, resume_id)
+        if not broadcast:
+            raise click.ClickException(f"No broadcast #{resume_id}")
+    elif message:
+        broadcast = Broadcast(message=message)
+        db.session.add(broadcast)
+        db.session.commit()
+    else:
+        raise click.ClickException("Give a MESSAGE or --resume ID")
+    run_broadcast(broadcast, retry_pending=retry_pending)
+    pending = broadcast_pending_count(broadcast)
+    print(f"broadcast #{broadcast.id} {broadcast.status}: sent {broadcast.sent}, failed {broadcast.failed}, "
+          f"skipped {broadcast.skipped}, pending {pending} in {broadcast.seconds:.1f}s")
+    if pending:
+        print(f"  {pending} number(s) were claimed by an interrupted run and never confirmed; "
+              f"send to them with: flask --app app broadcast --resume {broadcast.id} --retry-pending")
+
+# -------------------------
+# BACKGROUND JOBS
+# -------------------------
+# a Failed payment leaves status "Pending" until the customer retries or we give up
+SWEEPABLE_PAYMENT = ("Pending", "Failed")
+
+def sweep_abandoned_orders(timeout_minutes=None, batch_size=None):
+    """Expire ONLINE orders still unpaid (pending or failed) after the timeout.
+
+    Works in small batches with one short write transaction each, and the UPDATE
+    re-checks payment_status so a payment landing mid-sweep wins. Safe to re-run.
+    """
+    timeout_minutes = timeout_minutes or app.config["PENDING_PAYMENT_TIMEOUT_MINUTES"]
+    batch_size = batch_size or app.config["SWEEP_BATCH_SIZE"]
+    cutoff = datetime.utcnow() - timedelta(minutes=timeout_minutes)
+    start = time.monotonic()
+    expired = batches = 0
+    while True:
+        batch = (Order.query.options(db.selectinload(Order.items))
+                 .filter(Order.payment_method == "ONLINE", Order.payment_status.in_(SWEEPABLE_PAYMENT),
+                         Order.created_at < cutoff)
+                 .order_by(Order.id).limit(batch_size).all())
+        if not batch:
+            break
+        ids = [o.id for o in batch]
+        expired += Order.query.filter(Order.id.in_(ids), Order.payment_status.in_(SWEEPABLE_PAYMENT)).update(
+            {"payment_status": "Expired", "status": "Cancelled"}, synchronize_session="fetch")
+        for o in batch:
+            if o.payment_status == "Expired":
+                release_reservation(o)
+                record_order_event(o, "payment")
+        db.session.commit()
+        batches += 1
+        if len(batch) < batch_size:
+            break
+    stats = {"expired": expired, "batches": batches, "seconds": round(time.monotonic() - start, 3)}
+    print(f"sweep_abandoned_orders: expired {expired} order(s) in {batches} batch(es), {stats['seconds']}s")
+    return stats
+
+def run_scheduled_backup():
+    import backup_db
+    return backup_db.run_backup()
+
+
+class Scheduler:
+    """Tiny interval scheduler on a daemon thread. Each job runs inside an app context."""
+
+    def __init__(self):
+        self.jobs = []   # [name, interval, func, next_run]
+        self.stats = {}  # name -> last run info
+        self._thread = None
+
+    def add_job(self, name, interval, func):
+        self.jobs.append([name, interval, func, time.monotonic() + interval])
+
+    def run_job(self, name, func):
+        start = time.monotonic()
+        try:
+            with app.app_context():
+                result = func()
+            self.stats[name] = {"ok": True, "result": result, "at": datetime.utcnow()}
+        except Exception as e:
+            print(f"Scheduled job {name} failed:", e)
+            self.stats[name] = {"ok": False, "error": str(e), "at": datetime.utcnow()}
+        self.stats[name]["seconds"] = round(time.monotonic() - start, 3)
+
+    def _loop(self):
+        while True:
+            now = time.monotonic()
+            for job in self.jobs:
+                name, interval, func, next_run = job
+                if now >= next_run:
+                    self.run_job(name, func)
+                    job[3] = time.monotonic() + interval
+            time.sleep(1)
+
+    def start(self):
+        if self._thread is None and self.jobs:
+            self._thread = threading.Thread(target=self._loop, name="mmvali-scheduler", daemon=True)
+            self._thread.start()
+
+
+scheduler = Scheduler()
+_scheduler_lock_file = None
+
+def acquire_scheduler_lock() -> bool:
+    """Non-blocking host-wide lock so only one gunicorn worker runs the jobs."""
+    global _scheduler_lock_file
+    try:
+        import fcntl
+    except ImportError:
+        return True  # no flock (Windows dev box): single process anyway
+    f = open(os.path.join(INSTANCE_DIR, "scheduler.lock"), "w")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _scheduler_lock_file = f  # keep it open for the life of the process
+    return True
+
+def start_scheduler():
+    """Start the background jobs in this process. Called by the web server only, not at import."""
+    if not app.config.get("SCHEDULER_ENABLED") or not acquire_scheduler_lock():
+        return
+    scheduler.add_job("sweep_abandoned_orders", app.config["SWEEP_INTERVAL_SECONDS"], sweep_abandoned_orders)
+    if app.config.get("BACKUP_INTERVAL_SECONDS"):
+        scheduler.add_job("backup", app.config["BACKUP_INTERVAL_SECONDS"], run_scheduled_backup)
+    scheduler.start()
+
+@app.cli.command("sweep-orders")
+def sweep_orders_command():
+    """Expire abandoned ONLINE orders now (same job the scheduler runs)."""
+    sweep_abandoned_orders()
+
+STRESS_PRODUCT = "__stress_capacity__"
+
+def make_stress_app(db_path):
+    """A bare app bound to a scratch SQLite file, so the stress test never touches the live DB."""
+    stress_app = Flask(__name__)
+    stress_app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    stress_app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(stress_app)
+    return stress_app
+
+def stress_capacity_worker(args):
+    """One process's share of the attempts; runs in a multiprocessing child."""
+    db_path, attempts, capacity, day = args
+    results = {"reserved": 0, "rejected": 0, "retries": 0}
+    with make_stress_app(db_path).app_context():
+        for _ in range(attempts):
+            while True:
+                try:
+                    ok = reserve_stock(STRESS_PRODUCT, 1, day, capacity=capacity)
+                    db.session.commit()
+                    break
+                except OperationalError:  # "database is locked" under heavy SQLite contention
+                    db.session.rollback()
+                    results["retries"] += 1
+            results["reserved" if ok else "rejected"] += 1
+        db.session.remove()
+    return results
+
+@app.cli.command("stress-capacity")
+@click.option("--workers", default=8, help="parallel processes, like gunicorn workers")
+@click.option("--attempts", default=400, help="total single-unit reservation attempts")
+@click.option("--capacity", default=50, help="units available on the scratch product")
+def stress_capacity_command(workers, attempts, capacity):
+    """Hammer reserve_stock() from several processes on a scratch database and check nothing is oversold."""
+    import multiprocessing
+    import tempfile
+    day = date.today()
+    tmp_dir = tempfile.mkdtemp(prefix="mmvali-stress-")
+    db_path = os.path.join(tmp_dir, "stress.db")
+    with make_stress_app(db_path).app_context():
+        db.create_all()
+    shares = [attempts // workers + (1 if i < attempts % workers else 0) for i in range(workers)]
+    start = time.monotonic()
+    with multiprocessing.get_context().Pool(workers) as pool:
+        per_worker = pool.map(stress_capacity_worker, [(db_path, n, capacity, day) for n in shares if n])
+    elapsed = time.monotonic() - start
+    results = {k: sum(r[k] for r in per_worker) for k in ("reserved", "rejected", "retries")}
+    con = sqlite3.connect(db_path)
+    try:
+        row = con.execute("SELECT capacity, remaining FROM product_capacity WHERE product = ? AND day = ?",
+                          (STRESS_PRODUCT, day.isoformat())).fetchone()
+    finally:
+        con.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f"{attempts} attempts on {workers} processes in {elapsed:.2f}s: "
+          f"{results['reserved']} reserved, {results['rejected']} rejected, {results['retries']} lock retries")
+    print(f"capacity {row[0]}, remaining {row[1]}")
+    expected = min(capacity, attempts)
+    if results["reserved"] != expected or row[1] != capacity - expected:
+        raise click.ClickException("OVERSOLD or lost reservations - capacity accounting is wrong")
+    print("OK: no oversell")
+
 if __name__ == "__main__":
+    start_scheduler()
     app.run(debug=True)
@@ -0,0 +1,207 @@
+# backup_db.py - online database backups, verification and restore
+#
+#   python backup_db.py backup                 # one snapshot now
+#   python backup_db.py watch --interval 3600  # long-running scheduled job
+#   python backup_db.py list
+#   python backup_db.py verify [FILE]
+#   python backup_db.py restore FILE           # stop the app first
+#
+# Or from cron:  15 * * * *  cd /path/to/site && python backup_db.py backup
+#
+# SQLite is copied with the online backup API a few pages at a time, so the
+# lock is only held per step and order placement keeps going while it runs.
+# With DATABASE_URL=postgresql://... it shells out to pg_dump / pg_restore instead.
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DB_PATH = os.path.join(BASE_DIR, "instance", "mmvali_farm.db")
+BACKUP_DIR = os.path.join(BASE_DIR, "instance", "backups")
+PREFIX = "mmvali_farm-"
+
+PAGES_PER_STEP = 256      # ~1 MB with 4 KB pages
+STEP_SLEEP = 0.01         # pause between steps so writers can get in
+KEEP = 14                 # snapshots to keep after rotation
+
+
+def database_url():
+    return os.environ.get("DATABASE_URL", "")
+
+def is_postgres(url):
+    return url.startswith(("postgres://", "postgresql://"))
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def write_checksum(path):
+    digest = sha256_file(path)
+    with open(path + ".sha256", "w", encoding="utf-8") as f:
+        f.write(f"{digest}  {os.path.basename(path)}\n")
+    return digest
+
+def verify_checksum(path):
+    sidecar = path + ".sha256"
+    if not os.path.exists(sidecar):
+        print("No checksum file for", path)
+        return False
+    with open(sidecar, "r", encoding="utf-8") as f:
+        expected = f.read().split()[0]
+    return sha256_file(path) == expected
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [n for n in os.listdir(backup_dir) if n.startswith(PREFIX) and not n.endswith(".sha256")]
+    return [os.path.join(backup_dir, n) for n in sorted(names)]
+
+def rotate(backup_dir=BACKUP_DIR, keep=KEEP):
+    removed = 0
+    for path in list_snapshots(backup_dir)[:-max(keep, 1)]:
+        for p in (path, path + ".sha256"):
+            if os.path.exists(p):
+                os.remove(p)
+        removed += 1
+    return removed
+
+def backup_sqlite(db_path, dest, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """Copy a live SQLite database into gzip `dest`. Returns uncompressed size in bytes."""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    fd, tmp = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(dest))
+    os.close(fd)
+    try:
+        src = sqlite3.connect(db_path)
+        dst = sqlite3.connect(tmp)
+        try:
+            # each step holds the read lock for `pages` pages only
+            src.backup(dst, pages=pages, sleep=sleep)
+            ok = dst.execute("PRAGMA integrity_check").fetchone()[0]
+            if ok != "ok":
+                raise RuntimeError(f"integrity_check failed on snapshot: {ok}")
+        finally:
+            dst.close()
+            src.close()
+        raw_bytes = os.path.getsize(tmp)
+        with open(tmp, "rb") as f_in, gzip.open(dest, "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        return raw_bytes
+    finally:
+        os.remove(tmp)
+
+def backup_postgres(url, dest):
+    # custom format is already compressed and is what pg_restore expects
+    subprocess.run(["pg_dump", "--format=custom", "--compress=6", "--file", dest, url], check=True)
+    return os.path.getsize(dest)
+
+def run_backup(db_path=DB_PATH, backup_dir=BACKUP_DIR, keep=KEEP):
+    """Take one snapshot, checksum it, rotate old ones. Returns a stats dict."""
+    os.makedirs(backup_dir, exist_ok=True)
+    url = database_url()
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    start = time.monotonic()
+    if is_postgres(url):
+        dest = os.path.join(backup_dir, f"{PREFIX}{stamp}.dump")
+        raw_bytes = backup_postgres(url, dest)
+    else:
+        dest = os.path.join(backup_dir, f"{PREFIX}{stamp}.db.gz")
+        raw_bytes = backup_sqlite(db_path, dest)
+    digest = write_checksum(dest)
+    if not verify_checksum(dest):
+        raise RuntimeError(f"checksum mismatch right after writing {dest}")
+    removed = rotate(backup_dir, keep)
+    stats = {
+        "file": dest,
+        "sha256": digest,
+        "bytes": raw_bytes,
+        "compressed_bytes": os.path.getsize(dest),
+        "seconds": round(time.monotonic() - start, 3),
+        "rotated": removed,
+    }
+    print(f"Backup written: {dest}")
+    print(f"  {stats['bytes']} bytes -> {stats['compressed_bytes']} compressed in {stats['seconds']}s; "
+          f"rotated {removed} old snapshot(s)")
+    return stats
+
+def run_restore(path, db_path=DB_PATH):
+    """Restore a snapshot over the live database. Stop the app workers first."""
+    if not verify_checksum(path):
+        raise RuntimeError(f"checksum verification failed for {path}; not restoring")
+    start = time.monotonic()
+    if path.endswith(".dump"):
+        url = database_url()
+        if not is_postgres(url):
+            raise RuntimeError("restoring a .dump needs DATABASE_URL pointing at Postgres")
+        subprocess.run(["pg_restore", "--clean", "--if-exists", "--no-owner", "--dbname", url, path], check=True)
+    else:
+        fd, tmp = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(db_path))
+        os.close(fd)
+        try:
+            with gzip.open(path, "rb") as f_in, open(tmp, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+            src = sqlite3.connect(tmp)
+            dst = sqlite3.connect(db_path)
+            try:
+                ok = src.execute("PRAGMA integrity_check").fetchone()[0]
+                if ok != "ok":
+                    raise RuntimeError(f"snapshot failed integrity_check: {ok}")
+                # backup API into the live file keeps its inode and any open handles valid
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+        finally:
+            os.remove(tmp)
+    print(f"Restored {path} in {time.monotonic() - start:.3f}s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MMVALI Farm database backups")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("backup", help="take one snapshot now")
+    p.add_argument("--keep", type=int, default=KEEP)
+    p = sub.add_parser("watch", help="take a snapshot every --interval seconds")
+    p.add_argument("--interval", type=int, default=3600)
+    p.add_argument("--keep", type=int, default=KEEP)
+    sub.add_parser("list", help="list snapshots")
+    p = sub.add_parser("verify", help="check snapshot checksums")
+    p.add_argument("file", nargs="?")
+    p = sub.add_parser("restore", help="restore a snapshot over the live database")
+    p.add_argument("file")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "backup":
+        run_backup(keep=args.keep)
+    elif args.cmd == "watch":
+        while True:
+            try:
+                run_backup(keep=args.keep)
+            except Exception as e:
+                print("Backup failed:", e)
+            time.sleep(args.interval)
+    elif args.cmd == "list":
+        for path in list_snapshots():
+            print(f"{os.path.getsize(path):>12}  {path}")
+    elif args.cmd == "verify":
+        paths = [args.file] if args.file else list_snapshots()
+        bad = [p for p in paths if not verify_checksum(p)]
+        for p in paths:
+            print("BAD " if p in bad else "ok  ", p)
+        return 1 if bad else 0
+    elif args.cmd == "restore":
+        run_restore(args.file)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# fake_twilio.py - local stand-in for the Twilio Messages API, for testing broadcasts
+#
+#   python fake_twilio.py --port 8765 --limit 10
+#
+# then in app.py set TWILIO_API_BASE = "http://127.0.0.1:8765" (plus any non-empty
+# TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN) and run: flask --app app broadcast "Fresh paneer today!"
+#
+# Answers 429 + Retry-After when more than --limit messages arrive within one second,
+# the way Twilio does, and fails numbers listed with --fail.
+import argparse
+import json
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+state = {"received": 0, "rejected": 0, "window": 0, "count": 0, "to": {}}
+lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    limit = 10
+    fail = set()
+    delay = 0.0
+
+    def _json(self, code, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # quick stats: curl http://127.0.0.1:8765/stats
+        with lock:
+            dupes = sum(1 for n in state["to"].values() if n > 1)
+            self._json(200, {"received": state["received"], "rejected": state["rejected"],
+                             "unique_recipients": len(state["to"]), "duplicates": dupes})
+
+    def do_POST(self):
+        if not self.path.endswith("/Messages.json"):
+            return self._json(404, {"message": "not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        to = form.get("To", [""])[0]
+        now = int(time.time())
+        with lock:
+            if state["window"] != now:
+                state["window"], state["count"] = now, 0
+            state["count"] += 1
+            if state["count"] > self.limit:
+                state["rejected"] += 1
+                return self._json(429, {"code": 20429, "message": "Too Many Requests"}, {"Retry-After": "1"})
+            state["received"] += 1
+            state["to"][to] = state["to"].get(to, 0) + 1
+        if self.delay:
+            time.sleep(self.delay)
+        if to.replace("whatsapp:", "") in self.fail:
+            return self._json(400, {"code": 21211, "message": f"Invalid 'To' Phone Number: {to}"})
+        self._json(201, {"sid": "SM" + uuid.uuid4().hex, "status": "queued", "to": to})
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Twilio Messages endpoint")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--limit", type=int, default=10, help="messages per second before 429")
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds of simulated latency")
+    parser.add_argument("--fail", action="append", default=[], help="phone number to reject (repeatable)")
+    args = parser.parse_args()
+    Handler.limit, Handler.delay, Handler.fail = args.limit, args.delay, set(args.fail)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"Fake Twilio on http://127.0.0.1:{args.port} (limit {args.limit}/s)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# gunicorn.conf.py - picked up automatically by: gunicorn app:app
+#
+# Background jobs (abandoned-order sweep, scheduled backups) start here rather than
+# when app.py is imported, so flask CLI commands never run them. Only one worker per
+# host actually gets the scheduler lock; the others return straight away.
+
+
+def post_worker_init(worker):
+    from app import start_scheduler
+    start_scheduler()
@@ -0,0 +1,30 @@
+# migrate_add_idempotency_key.py
+import sqlite3
+import os
+
+DB_PATH = os.path.join("instance", "mmvali_farm.db")
+
+if not os.path.exists(DB_PATH):
+    print("ERROR: DB not found at", DB_PATH)
+    raise SystemExit(1)
+
+con = sqlite3.connect(DB_PATH)
+cur = con.cursor()
+
+cur.execute("PRAGMA table_info('order')")
+cols = [r[1] for r in cur.fetchall()]
+
+# Add idempotency_key column if missing (SQLite can't ADD a UNIQUE column, so index it separately)
+if "idempotency_key" not in cols:
+    print("Adding column 'idempotency_key' to 'order'...")
+    cur.execute("ALTER TABLE 'order' ADD COLUMN idempotency_key TEXT")
+    con.commit()
+    print("Added 'idempotency_key'.")
+else:
+    print("'idempotency_key' already exists.")
+
+# Existing rows stay NULL; SQLite allows many NULLs under a unique index
+cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_order_idempotency_key ON 'order' (idempotency_key)")
+con.commit()
+con.close()
+print("Migration finished. Restart your Flask app now.")
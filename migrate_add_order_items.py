@@ -0,0 +1,52 @@
+# migrate_add_order_items.py
+import sqlite3
+import os
+
+DB_PATH = os.path.join("instance", "mmvali_farm.db")
+
+if not os.path.exists(DB_PATH):
+    print("ERROR: DB not found at", DB_PATH)
+    raise SystemExit(1)
+
+con = sqlite3.connect(DB_PATH)
+cur = con.cursor()
+
+# 1) Create order_item if the app hasn't already (db.create_all does this on start)
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS order_item (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL REFERENCES "order" (id),
+        product VARCHAR(120) NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price INTEGER NOT NULL,
+        line_total INTEGER NOT NULL
+    )
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS ix_order_item_order_id ON order_item (order_id)")
+con.commit()
+
+# 2) One line per existing single-product order that has no lines yet
+cur.execute("""
+    SELECT o.id, o.product, o.quantity, o.total_price
+    FROM 'order' o
+    WHERE NOT EXISTS (SELECT 1 FROM order_item i WHERE i.order_id = o.id)
+""")
+rows = cur.fetchall()
+lines = []
+for oid, product, qty, tprice in rows:
+    try:
+        qty = int(qty) if qty is not None else 1
+    except (TypeError, ValueError):
+        qty = 1
+    qty = max(qty, 1)
+    total = int(tprice or 0)
+    lines.append((oid, product or "", qty, total // qty, total))
+
+cur.executemany(
+    "INSERT INTO order_item (order_id, product, quantity, unit_price, line_total) VALUES (?, ?, ?, ?, ?)",
+    lines
+)
+con.commit()
+print(f"Backfilled {len(lines)} order line(s).")
+con.close()
+print("Migration finished. Restart your Flask app now.")
@@ -0,0 +1,27 @@
+# migrate_add_reserved_day.py
+import sqlite3
+import os
+
+DB_PATH = os.path.join("instance", "mmvali_farm.db")
+
+if not os.path.exists(DB_PATH):
+    print("ERROR: DB not found at", DB_PATH)
+    raise SystemExit(1)
+
+con = sqlite3.connect(DB_PATH)
+cur = con.cursor()
+
+cur.execute("PRAGMA table_info('order')")
+cols = [r[1] for r in cur.fetchall()]
+
+# Existing orders were placed before capacity tracking, so they hold no reservation (NULL)
+if "reserved_day" not in cols:
+    print("Adding column 'reserved_day' to 'order'...")
+    cur.execute("ALTER TABLE 'order' ADD COLUMN reserved_day DATE")
+    con.commit()
+    print("Added 'reserved_day'.")
+else:
+    print("'reserved_day' already exists.")
+
+con.close()
+print("Migration finished. The product_capacity table is created on app start. Restart your Flask app now.")
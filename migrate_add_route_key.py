@@ -0,0 +1,50 @@
+# migrate_add_route_key.py
+import sqlite3
+import os
+import re
+
+DB_PATH = os.path.join("instance", "mmvali_farm.db")
+
+# must match route_key_for_address() in app.py
+PINCODE_RE = re.compile(r"\b(\d{3})\s?(\d{3})\b")
+
+def route_key_for_address(address):
+    if not address:
+        return ""
+    m = PINCODE_RE.search(address)
+    if m:
+        return f"PIN {m.group(1)}{m.group(2)}"
+    parts = [p.strip() for p in re.split(r"[,\n]+", address) if p.strip()]
+    if not parts:
+        return ""
+    area = parts[-2] if len(parts) >= 2 else parts[0]
+    area = re.sub(r"[^\w\s-]", "", area)
+    return " ".join(area.split()).title()[:60]
+
+if not os.path.exists(DB_PATH):
+    print("ERROR: DB not found at", DB_PATH)
+    raise SystemExit(1)
+
+con = sqlite3.connect(DB_PATH)
+cur = con.cursor()
+
+cur.execute("PRAGMA table_info('order')")
+cols = [r[1] for r in cur.fetchall()]
+if "route_key" not in cols:
+    print("Adding column 'route_key' to 'order'...")
+    cur.execute("ALTER TABLE 'order' ADD COLUMN route_key TEXT")
+    con.commit()
+    print("Added 'route_key'.")
+else:
+    print("'route_key' already exists.")
+cur.execute("CREATE INDEX IF NOT EXISTS ix_order_route_key ON 'order' (route_key)")
+con.commit()
+
+# Backfill rows that don't have a route yet
+cur.execute("SELECT id, address FROM 'order' WHERE route_key IS NULL")
+updates = [(route_key_for_address(addr), oid) for oid, addr in cur.fetchall()]
+cur.executemany("UPDATE 'order' SET route_key = ? WHERE id = ?", updates)
+con.commit()
+print(f"Backfilled {len(updates)} rows.")
+con.close()
+print("Migration finished. Restart your Flask app now.")
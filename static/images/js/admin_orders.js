@@ -0,0 +1,108 @@
+// static/js/admin_orders.js - live order feed for /admin/orders (polls /admin/orders/changes)
+
+document.addEventListener("DOMContentLoaded", function () {
+  const table = document.getElementById("orders-table");
+  if (!table || !window.fetch) return;
+
+  const tbody = table.querySelector("tbody");
+  const statusUrl = table.dataset.statusUrl; // .../orders/0/status
+  const STATUSES = ["Pending", "Processing", "Paid", "Delivered", "Cancelled"];
+
+  function text(value) {
+    return value === null || value === undefined ? "" : String(value);
+  }
+
+  function cell(content, cls) {
+    const td = document.createElement("td");
+    td.className = "px-3 py-2" + (cls ? " " + cls : "");
+    td.textContent = content;
+    return td;
+  }
+
+  function statusCell(o) {
+    const td = cell("");
+    const pay = document.createElement("div");
+    pay.className = "text-[11px] text-slate-500 mb-1";
+    pay.dataset.field = "payment";
+    td.appendChild(pay);
+
+    const form = document.createElement("form");
+    form.method = "post";
+    form.action = statusUrl.replace("/0/", "/" + o.id + "/");
+    const select = document.createElement("select");
+    select.name = "status";
+    select.className = "text-xs border rounded px-1 py-0.5";
+    STATUSES.forEach(s => select.appendChild(new Option(s, s)));
+    const btn = document.createElement("button");
+    btn.className = "mt-1 text-[11px] px-2 py-0.5 rounded bg-emerald-600 text-white";
+    btn.textContent = "Update";
+    form.appendChild(select);
+    form.appendChild(btn);
+    td.appendChild(form);
+    return td;
+  }
+
+  function buildRow(o) {
+    const tr = document.createElement("tr");
+    tr.className = "hover:bg-emerald-50/40 align-top bg-yellow-50";
+    tr.dataset.orderId = o.id;
+    tr.appendChild(cell(o.id));
+    tr.appendChild(cell(text(o.customer_name) + (o.user_id ? " (user)" : " (guest)")));
+    tr.appendChild(cell(text(o.product)));
+    tr.appendChild(cell(o.quantity));
+    tr.appendChild(cell("₹" + (o.total_price || 0), "font-semibold text-emerald-700"));
+    tr.appendChild(statusCell(o));
+    tr.appendChild(cell(text(o.phone)));
+    tr.appendChild(cell(o.customer_email || "-"));
+    tr.appendChild(cell(text(o.created_at), "text-xs whitespace-nowrap"));
+    tr.appendChild(cell("Reload for actions", "text-xs text-slate-400"));
+    return tr;
+  }
+
+  function patchRow(tr, o) {
+    const select = tr.querySelector("select[name=status]");
+    // don't clobber a status the admin is in the middle of changing
+    if (select && document.activeElement !== select) select.value = o.status;
+    const pay = tr.querySelector("[data-field=payment]");
+    if (pay) pay.textContent = (o.payment_method || "COD") + " · " + (o.payment_status || "Pending");
+  }
+
+  function findRow(id) {
+    return tbody.querySelector('tr[data-order-id="' + id + '"]');
+  }
+
+  function onChange(o) {
+    let tr = findRow(o.id);
+    if (!tr) {
+      tr = buildRow(o);
+      tbody.insertBefore(tr, tbody.firstChild);
+      document.getElementById("orders-table-wrap").classList.remove("hidden");
+      document.getElementById("orders-empty").classList.add("hidden");
+    }
+    patchRow(tr, o);
+  }
+
+  function onDeleted(o) {
+    const tr = findRow(o.id);
+    if (tr) tr.remove();
+  }
+
+  // each poll asks only for events after the last one seen, so nothing is missed or repeated
+  const changesUrl = table.dataset.changesUrl;
+  const pollMs = parseInt(table.dataset.pollMs, 10) || 3000;
+  let lastId = parseInt(table.dataset.lastId, 10) || 0;
+
+  function poll() {
+    if (document.hidden) return setTimeout(poll, pollMs * 5);
+    fetch(changesUrl + "?after=" + lastId, {credentials: "same-origin", headers: {"Accept": "application/json"}})
+      .then(r => r.ok ? r.json() : Promise.reject(r.status))
+      .then(data => {
+        data.events.forEach(ev => (ev.kind === "deleted" ? onDeleted : onChange)(ev.order));
+        lastId = data.last_id;
+        // go again straight away after a batch in case more are waiting
+        setTimeout(poll, data.events.length ? 0 : pollMs);
+      })
+      .catch(() => setTimeout(poll, pollMs * 5));
+  }
+  setTimeout(poll, pollMs);
+});